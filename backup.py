@@ -1,8 +1,12 @@
 import os
 import psycopg
 import csv
+import gzip
+import json
+import shutil
 import boto3
-from datetime import datetime
+import tempfile
+from datetime import datetime, timedelta
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -163,6 +167,103 @@ def export_recent_inquiries(days=30):
         print(f"❌ Export failed: {e}")
         return None
 
+EXPORT_FORMATS = ("csv", "jsonl")
+MAX_DOCUMENT_BYTES = 45 * 1024 * 1024  # Telegram bots can upload up to 50 MB per document
+
+def close_handles(*handles):
+    """Close an export part's writer and underlying file (the gzip writer doesn't close its file)"""
+    for handle in handles:
+        if handle is not None and not handle.closed:
+            handle.close()
+
+def export_inquiries(fmt="csv", start=None, end=None, progress=None, max_part_bytes=MAX_DOCUMENT_BYTES):
+    """
+    Export inquiries created between start and end (inclusive dates) as CSV or gzipped JSONL.
+    Rows are streamed from a server-side cursor and written to temp files that roll over
+    before max_part_bytes, so each part can be sent as a single Telegram document.
+    `progress` is an optional dict updated with "rows" and "total" as the export runs.
+    Returns the list of part filenames (the caller deletes them).
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unsupported export format: {fmt}")
+
+    end = end or datetime.now().date()
+    start = start or end - timedelta(days=30)
+    # Half-open range on created_at so only the matching monthly partitions are scanned
+    params = (start, end + timedelta(days=1))
+    progress = progress if progress is not None else {}
+    progress.update(rows=0, total=0)
+
+    conn = psycopg.connect(os.getenv("DATABASE_URL"))
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT COUNT(*) FROM inquiries WHERE created_at >= %s AND created_at < %s", params)
+            progress["total"] = cur.fetchone()[0]
+
+        workdir = tempfile.mkdtemp(prefix="export_")
+        parts = []
+        raw = out = writer = None
+        try:
+            prefix = f"inquiries_{start:%Y%m%d}_{end:%Y%m%d}"
+            extension = "csv" if fmt == "csv" else "jsonl.gz"
+
+            with conn.cursor(name="inquiries_export") as cur:
+                cur.itersize = 2000
+                cur.execute("""
+                    SELECT * FROM inquiries
+                    WHERE created_at >= %s AND created_at < %s
+                    ORDER BY created_at
+                """, params)
+                columns = None
+
+                for row in cur:
+                    if columns is None:
+                        columns = [desc[0] for desc in cur.description]
+
+                    # Checking the size every few hundred rows keeps tell() off the hot path
+                    if raw is None or (progress["rows"] % 500 == 0 and raw.tell() >= max_part_bytes):
+                        close_handles(out, raw)
+                        filename = os.path.join(workdir, f"{prefix}_part{len(parts) + 1}.{extension}")
+                        parts.append(filename)
+                        if fmt == "csv":
+                            raw = out = open(filename, 'w', newline='', encoding='utf-8')
+                            writer = csv.writer(out)
+                            writer.writerow(columns)
+                        else:
+                            raw = open(filename, 'wb')
+                            out = gzip.open(raw, 'wt', encoding='utf-8')
+
+                    if fmt == "csv":
+                        writer.writerow(row)
+                    else:
+                        out.write(json.dumps(dict(zip(columns, row)), default=str, ensure_ascii=False) + "\n")
+
+                    progress["rows"] += 1
+
+            close_handles(out, raw)
+
+            if not parts:
+                os.rmdir(workdir)
+
+            # A single-part export doesn't need the "_part1" suffix
+            if len(parts) == 1:
+                single = parts[0].replace("_part1.", ".")
+                os.rename(parts[0], single)
+                parts = [single]
+        except BaseException:
+            # Don't leave half-written parts behind in /tmp
+            try:
+                close_handles(out, raw)
+            except OSError:
+                pass
+            shutil.rmtree(workdir, ignore_errors=True)
+            raise
+    finally:
+        conn.close()
+
+    print(f"✅ Exported {progress['rows']} inquiries to {len(parts)} file(s)")
+    return parts
+
 if __name__ == "__main__":
     print("=" * 50)
     print("🔐 TechSynergy Database Backup System")
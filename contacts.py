@@ -0,0 +1,53 @@
+"""
+Contact detection and extraction shared by the bot and the lead enrichment job.
+Patterns are compiled once at import instead of on every message.
+"""
+
+import re
+
+EMAIL_PATTERN = re.compile(r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b')
+PHONE_PATTERN = re.compile(r'[\+]?[0-9\s\-\(\)]{10,}')
+# Pattern for values we store: starts and ends on a digit (optionally "+" or "(" first) so
+# surrounding spaces and dashes aren't kept. extract_contact_info also drops " - " ranges
+# ("1000000 - 2000000") and anything under MIN_PHONE_DIGITS digits ("2024-2025")
+STORED_PHONE_PATTERN = re.compile(r'(?<![\w+])(?:\+|\()?[0-9][0-9\s\-\(\)]{6,}[0-9]')
+
+MIN_PHONE_DIGITS = 10
+
+
+def contains_contact_info(message):
+    """Check if message contains email or phone number"""
+    has_email = EMAIL_PATTERN.search(message) is not None
+    has_phone = PHONE_PATTERN.search(message) is not None
+
+    return has_email or has_phone, has_email, has_phone
+
+
+def first_email(message):
+    match = EMAIL_PATTERN.search(message)
+    return match.group() if match else None
+
+
+def extract_contact_info(message):
+    """Return every distinct email and phone number in the message, in order of appearance"""
+    emails = list(dict.fromkeys(EMAIL_PATTERN.findall(message)))
+
+    phones = []
+    for match in STORED_PHONE_PATTERN.findall(message):
+        phone = match.strip()
+        if " - " in phone:
+            continue
+        if sum(c.isdigit() for c in phone) >= MIN_PHONE_DIGITS and phone not in phones:
+            phones.append(phone)
+
+    return emails, phones
+
+
+def format_contact_info(emails, phones):
+    """Format contacts the way they're stored in inquiries.contact_info"""
+    parts = []
+    if emails:
+        parts.append(f"Email: {', '.join(emails)}")
+    if phones:
+        parts.append(f"Phone: {', '.join(phones)}")
+    return "; ".join(parts)
@@ -0,0 +1,239 @@
+"""
+Crash-safe local journal for inquiries that can't be written to PostgreSQL.
+
+Inquiries are appended to JSONL segment files, one record per line prefixed
+with a CRC32 of its payload so torn or corrupted lines are detected on replay.
+Writes reach the OS immediately and are fsynced in batches (every
+FSYNC_EVERY records or FSYNC_INTERVAL seconds). A replayer bulk-loads closed
+segments into inquiries once the database is back, skipping records that were
+already loaded (by journal_id) or that reached the database directly after
+all (by inquiry_key, e.g. when the commit succeeded but its reply was lost),
+and deletes each segment after its transaction commits. Lines that fail their CRC are copied to a `.corrupt`
+sidecar first, and a segment the database rejects (bad data rather than a
+lost connection) is set aside as `.quarantine` so it can't block the rest.
+
+The journal lives on local disk: it survives process crashes and restarts,
+but not a redeploy onto a fresh container.
+"""
+
+import glob
+import json
+import os
+import threading
+import time
+import uuid
+import zlib
+
+import psycopg
+
+JOURNAL_DIR = os.getenv("JOURNAL_DIR", "journal")
+FSYNC_EVERY = 20       # records
+FSYNC_INTERVAL = 1.0   # seconds
+DB_RETRY_COOLDOWN = 30 # seconds to skip the database after a failure
+
+JOURNAL_COLUMNS = ("journal_id", "inquiry_key", "user_id", "username", "first_name", "last_name",
+                   "message", "response", "contact_info", "created_at")
+# Parameters in INSERT ... SELECT have no target column to infer their type from
+JOURNAL_CASTS = {"journal_id": "uuid", "inquiry_key": "uuid", "user_id": "bigint", "created_at": "timestamp"}
+
+REPLAY_INSERT = f'''
+    INSERT INTO inquiries ({", ".join(JOURNAL_COLUMNS)})
+    SELECT {", ".join(f"%s::{JOURNAL_CASTS.get(column, 'text')}" for column in JOURNAL_COLUMNS)}
+    WHERE NOT EXISTS (SELECT 1 FROM inquiries WHERE inquiry_key = %s::uuid)
+    ON CONFLICT (journal_id, created_at) DO NOTHING
+'''
+
+
+def ensure_journal_schema(conn):
+    """Add journal_id and the indexes replay uses for deduplication"""
+    with conn.cursor() as cur:
+        cur.execute("ALTER TABLE inquiries ADD COLUMN IF NOT EXISTS journal_id UUID")
+        # Unique indexes on a partitioned table must include the partition key
+        cur.execute('''
+            CREATE UNIQUE INDEX IF NOT EXISTS inquiries_journal_id_idx
+            ON inquiries (journal_id, created_at)
+        ''')
+        # Not unique for the same reason; replay checks it with NOT EXISTS instead
+        cur.execute('''
+            CREATE INDEX IF NOT EXISTS inquiries_inquiry_key_idx
+            ON inquiries (inquiry_key)
+        ''')
+    conn.commit()
+
+
+def encode_record(record):
+    payload = json.dumps(record, default=str, ensure_ascii=False, separators=(",", ":"))
+    return f"{zlib.crc32(payload.encode('utf-8')):08x} {payload}\n"
+
+
+def decode_line(line):
+    """Return the record stored on a journal line, or None if it is torn or corrupt"""
+    checksum, _, payload = line.rstrip("\n").partition(" ")
+    try:
+        if int(checksum, 16) != zlib.crc32(payload.encode("utf-8")):
+            return None
+        return json.loads(payload)
+    except ValueError:
+        return None
+
+
+def read_segment(path):
+    """Return (records, corrupt_lines) for one segment file"""
+    records = []
+    corrupt = []
+    with open(path, encoding="utf-8", errors="replace") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = decode_line(line)
+            if record is None:
+                corrupt.append(line if line.endswith("\n") else line + "\n")
+            else:
+                records.append(record)
+    return records, corrupt
+
+
+def fsync_directory(directory):
+    """fsync a directory so a file created or renamed in it survives a crash"""
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def save_corrupt_lines(path, lines):
+    """Keep lines that failed their CRC next to the segment for manual recovery"""
+    with open(path + ".corrupt", "a", encoding="utf-8") as f:
+        f.writelines(lines)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+class InquiryJournal:
+    """Append-only, fsync-batched journal with a replayer for the inquiries table"""
+
+    def __init__(self, directory=JOURNAL_DIR, fsync_every=FSYNC_EVERY, fsync_interval=FSYNC_INTERVAL):
+        self.directory = directory
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.lock = threading.Lock()
+        self.file = None
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+        self.db_down_until = 0.0
+        self.schema_ready = False
+
+    # === DATABASE HEALTH ===
+    def mark_db_down(self):
+        """Skip the database for a while so requests don't each wait on a dead connection"""
+        self.db_down_until = time.monotonic() + DB_RETRY_COOLDOWN
+
+    def db_suspect(self):
+        return time.monotonic() < self.db_down_until
+
+    # === WRITING ===
+    def _open_segment(self):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"segment_{time.time_ns()}.jsonl")
+        self.file = open(path, "a", encoding="utf-8")
+        # The file's directory entry must be durable too, or fsynced records can vanish with it
+        fsync_directory(self.directory)
+
+    def append(self, inquiry):
+        """Journal an inquiry dict and return its journal_id"""
+        record = dict(inquiry, journal_id=str(uuid.uuid4()))
+        line = encode_record(record)
+        with self.lock:
+            if self.file is None:
+                self._open_segment()
+            self.file.write(line)
+            self.file.flush()
+            self.unsynced += 1
+            if self.unsynced >= self.fsync_every or time.monotonic() - self.last_sync >= self.fsync_interval:
+                self._sync()
+        print(f"📝 Inquiry journaled locally ({record['journal_id']})")
+        return record["journal_id"]
+
+    def _sync(self):
+        if self.file is not None and self.unsynced:
+            os.fsync(self.file.fileno())
+        self.unsynced = 0
+        self.last_sync = time.monotonic()
+
+    def sync(self):
+        """fsync any records written since the last batch"""
+        with self.lock:
+            self._sync()
+
+    def close(self):
+        with self.lock:
+            self._close_segment()
+
+    def _close_segment(self):
+        if self.file is not None:
+            self._sync()
+            self.file.close()
+            self.file = None
+
+    # === REPLAY ===
+    def has_pending(self):
+        return bool(glob.glob(os.path.join(self.directory, "segment_*.jsonl")))
+
+    def replay(self, conn):
+        """
+        Load every closed segment into inquiries, one transaction per segment.
+        Returns the number of records inserted (duplicates are skipped).
+        """
+        with self.lock:
+            # New appends go to a fresh segment, so everything listed here is closed
+            self._close_segment()
+            segments = sorted(glob.glob(os.path.join(self.directory, "segment_*.jsonl")))
+        if not segments:
+            return 0
+
+        if not self.schema_ready:
+            ensure_journal_schema(conn)
+            self.schema_ready = True
+
+        inserted = 0
+        loaded = 0
+        for path in segments:
+            records, corrupt = read_segment(path)
+            # Compact duplicates within the segment before loading
+            unique = {record["journal_id"]: record for record in records}
+            rows = [
+                tuple(record.get(column) for column in JOURNAL_COLUMNS) + (record.get("inquiry_key"),)
+                for record in unique.values()
+            ]
+
+            try:
+                with conn.cursor() as cur:
+                    cur.executemany(REPLAY_INSERT, rows)
+                    count = max(cur.rowcount, 0)
+                conn.commit()
+            except psycopg.OperationalError:
+                # Lost connection or timeout: leave the segment for the next replay
+                conn.rollback()
+                raise
+            except psycopg.Error as e:
+                # The database rejected the data itself; retrying won't help, so set it aside
+                conn.rollback()
+                if corrupt:
+                    save_corrupt_lines(path, corrupt)
+                os.replace(path, path + ".quarantine")
+                print(f"❌ Quarantined {os.path.basename(path)}: {e}")
+                continue
+            inserted += count
+            loaded += 1
+            if corrupt:
+                save_corrupt_lines(path, corrupt)
+                print(f"⚠️ Skipped {len(corrupt)} corrupt line(s) in {os.path.basename(path)}, kept in .corrupt")
+            os.remove(path)
+
+        self.db_down_until = 0.0
+        print(f"✅ Replayed journal: {inserted} inquiries restored from {loaded} segment(s)")
+        return inserted
+
+
+inquiry_journal = InquiryJournal()
@@ -0,0 +1,264 @@
+"""
+Background lead enrichment and scoring.
+
+Picks up inquiries that haven't been enriched yet in batches, extracts every
+email and phone number, classifies intent and urgency for the whole batch in a
+single LLM request, and writes the results back with one bulk UPDATE per batch.
+Because rows are selected by enriched_at IS NULL, an interrupted run simply
+resumes with whatever is left; enrichment_checkpoints keeps running totals for
+throughput reporting.
+
+Usage: python lead_enrichment.py
+"""
+
+import json
+import os
+import time
+
+import openai
+import psycopg
+from dotenv import load_dotenv
+
+from contacts import extract_contact_info, format_contact_info
+from usage import ensure_usage_schema, usage_tracker
+
+# Load environment variables
+load_dotenv()
+
+BATCH_SIZE = int(os.getenv("ENRICHMENT_BATCH_SIZE", 20))
+MAX_BATCHES_PER_RUN = int(os.getenv("ENRICHMENT_MAX_BATCHES", 50))
+ENRICHMENT_MODEL = os.getenv("ENRICHMENT_MODEL", "gpt-3.5-turbo")
+MESSAGE_CHARS = 500          # per-inquiry text sent to the model
+TOKENS_PER_INQUIRY = 40      # completion budget per classified inquiry
+MAX_PARSE_FAILURES = 3       # unparseable replies before a batch is marked 'unknown'
+
+CHECKPOINT_NAME = "lead_enrichment"
+
+INTENTS = [
+    "web_development", "mobile_app", "cloud_infrastructure", "cybersecurity",
+    "ai_automation", "events", "consulting", "real_estate", "general_question", "spam",
+]
+URGENCIES = ["low", "medium", "high"]
+
+CLASSIFY_PROMPT = f"""You qualify business leads for TechSynergy Solutions, an IT services company.
+You will receive a JSON array of customer inquiries, each with an "id" and a "message".
+Return ONLY a JSON array with one object per inquiry, in any order:
+{{"id": <id>, "intent": <one of {INTENTS}>, "urgency": <one of {URGENCIES}>, "score": <0-100 likelihood this is a real paying lead>}}"""
+
+
+# Batches whose model output couldn't be parsed, keyed by their inquiry ids
+parse_failures = {}
+schema_ready = False
+
+
+def ensure_enrichment_schema(conn):
+    """
+    Add the enrichment columns and checkpoint table if they don't exist yet.
+    ALTER TABLE locks inquiries even when the columns exist, so this runs once per process.
+    """
+    global schema_ready
+    with conn.cursor() as cur:
+        cur.execute("ALTER TABLE inquiries ADD COLUMN IF NOT EXISTS intent VARCHAR(50)")
+        cur.execute("ALTER TABLE inquiries ADD COLUMN IF NOT EXISTS urgency VARCHAR(20)")
+        cur.execute("ALTER TABLE inquiries ADD COLUMN IF NOT EXISTS lead_score SMALLINT")
+        cur.execute("ALTER TABLE inquiries ADD COLUMN IF NOT EXISTS enriched_at TIMESTAMP")
+        # fetch_batch reads this instead of scanning every partition; it only holds pending rows
+        cur.execute('''
+            CREATE INDEX IF NOT EXISTS inquiries_unenriched_idx
+            ON inquiries (id) WHERE enriched_at IS NULL
+        ''')
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS enrichment_checkpoints (
+                name VARCHAR(50) PRIMARY KEY,
+                processed BIGINT NOT NULL DEFAULT 0,
+                api_calls BIGINT NOT NULL DEFAULT 0,
+                seconds DOUBLE PRECISION NOT NULL DEFAULT 0,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        cur.execute('''
+            INSERT INTO enrichment_checkpoints (name) VALUES (%s)
+            ON CONFLICT (name) DO NOTHING
+        ''', (CHECKPOINT_NAME,))
+    conn.commit()
+    schema_ready = True
+
+
+def fetch_batch(conn, batch_size=BATCH_SIZE):
+    # No id watermark: rows can commit out of id order (e.g. during a journal replay)
+    with conn.cursor() as cur:
+        cur.execute('''
+            SELECT id, created_at, message
+            FROM inquiries
+            WHERE enriched_at IS NULL
+            ORDER BY id
+            LIMIT %s
+        ''', (batch_size,))
+        return cur.fetchall()
+
+
+def classify_batch(rows):
+    """Classify a batch of (id, created_at, message) rows with a single completion"""
+    payload = [{"id": row[0], "message": (row[2] or "")[:MESSAGE_CHARS]} for row in rows]
+
+    started = time.monotonic()
+    response = openai.ChatCompletion.create(
+        model=ENRICHMENT_MODEL,
+        messages=[
+            {"role": "system", "content": CLASSIFY_PROMPT},
+            {"role": "user", "content": json.dumps(payload, ensure_ascii=False)},
+        ],
+        max_tokens=TOKENS_PER_INQUIRY * len(rows) + 50,
+        temperature=0
+    )
+    usage_tracker.record_completion(
+        response, None, ENRICHMENT_MODEL, (time.monotonic() - started) * 1000, source="enrichment"
+    )
+    return parse_classifications(response.choices[0].message.content)
+
+
+def parse_classifications(content):
+    """Parse the model's JSON array into {id: (intent, urgency, score)}, dropping malformed entries"""
+    start, end = content.find("["), content.rfind("]")
+    if start == -1 or end == -1:
+        raise ValueError("model did not return a JSON array")
+
+    results = {}
+    for item in json.loads(content[start:end + 1]):
+        try:
+            intent = item["intent"] if item["intent"] in INTENTS else "general_question"
+            urgency = item["urgency"] if item["urgency"] in URGENCIES else "low"
+            score = max(0, min(100, int(item["score"])))
+            results[int(item["id"])] = (intent, urgency, score)
+        except (KeyError, TypeError, ValueError):
+            continue
+    return results
+
+
+def write_batch(conn, rows, classifications, elapsed):
+    """Bulk-update a batch and add it to the checkpoint totals in the same transaction"""
+    ids, created, contacts, intents, urgencies, scores = [], [], [], [], [], []
+    for inquiry_id, created_at, message in rows:
+        # Inquiries the model skipped are still marked enriched so they aren't retried forever
+        intent, urgency, score = classifications.get(inquiry_id, ("unknown", None, None))
+        ids.append(inquiry_id)
+        created.append(created_at)
+        contacts.append(format_contact_info(*extract_contact_info(message or "")))
+        intents.append(intent)
+        urgencies.append(urgency)
+        scores.append(score)
+
+    with conn.cursor() as cur:
+        cur.execute('''
+            UPDATE inquiries AS i
+            SET contact_info = COALESCE(NULLIF(v.contact_info, ''), i.contact_info),
+                intent = v.intent,
+                urgency = v.urgency,
+                lead_score = v.lead_score,
+                enriched_at = CURRENT_TIMESTAMP
+            FROM unnest(%s::int[], %s::timestamp[], %s::text[], %s::text[], %s::text[], %s::smallint[])
+                AS v(id, created_at, contact_info, intent, urgency, lead_score)
+            WHERE i.id = v.id AND i.created_at = v.created_at
+        ''', (ids, created, contacts, intents, urgencies, scores))
+        cur.execute('''
+            UPDATE enrichment_checkpoints
+            SET processed = processed + %s,
+                api_calls = api_calls + 1,
+                seconds = seconds + %s,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE name = %s
+        ''', (len(ids), elapsed, CHECKPOINT_NAME))
+    conn.commit()
+
+
+def run_enrichment(conn, batch_size=BATCH_SIZE, max_batches=MAX_BATCHES_PER_RUN):
+    """
+    Enrich unprocessed inquiries in batches.
+    Returns a stats dict with inquiries per second and per API call.
+    """
+    if not schema_ready:
+        ensure_enrichment_schema(conn)
+
+    processed = api_calls = 0
+    started = time.monotonic()
+
+    for _ in range(max_batches):
+        rows = fetch_batch(conn, batch_size)
+        if not rows:
+            break
+
+        batch_started = time.monotonic()
+        batch_key = tuple(row[0] for row in rows)
+        try:
+            classifications = classify_batch(rows)
+            parse_failures.pop(batch_key, None)
+        except ValueError as e:
+            # At temperature 0 the same batch tends to fail the same way, so give up after a few tries
+            api_calls += 1
+            failures = parse_failures[batch_key] = parse_failures.get(batch_key, 0) + 1
+            if failures < MAX_PARSE_FAILURES:
+                conn.rollback()
+                print(f"❌ Could not parse lead classification ({failures}/{MAX_PARSE_FAILURES}): {e}")
+                break
+            print(f"⚠️ Marking {len(rows)} inquiries as 'unknown' after {failures} unparseable replies")
+            parse_failures.pop(batch_key, None)
+            classifications = {}
+        except Exception as e:
+            # Nothing is written, so the batch is picked up again on the next run
+            conn.rollback()
+            print(f"❌ Lead classification failed: {e}")
+            break
+        else:
+            api_calls += 1
+
+        write_batch(conn, rows, classifications, time.monotonic() - batch_started)
+        processed += len(rows)
+
+    elapsed = time.monotonic() - started
+    stats = {
+        "processed": processed,
+        "api_calls": api_calls,
+        "seconds": round(elapsed, 2),
+        "per_second": round(processed / elapsed, 2) if elapsed else 0.0,
+        "per_api_call": round(processed / api_calls, 2) if api_calls else 0.0,
+    }
+    if processed:
+        print(
+            f"✅ Enriched {processed} inquiries in {stats['seconds']}s "
+            f"({stats['per_second']}/s, {stats['per_api_call']} per API call)"
+        )
+    return stats
+
+
+def enrich_pending_leads(database_url=None):
+    """Open a connection and run one enrichment pass; safe to call from a worker thread"""
+    try:
+        conn = psycopg.connect(database_url or os.getenv("DATABASE_URL"))
+        stats = run_enrichment(conn)
+        conn.close()
+        return stats
+    except Exception as e:
+        print(f"❌ Lead enrichment failed: {e}")
+        return None
+
+
+if __name__ == "__main__":
+    openai.api_key = os.getenv("OPENAI_API_KEY")
+
+    print("=" * 50)
+    print("🎯 TechSynergy Lead Enrichment")
+    print("=" * 50)
+
+    conn = psycopg.connect(os.getenv("DATABASE_URL"))
+    ensure_enrichment_schema(conn)
+    conn.close()
+
+    enrich_pending_leads()
+
+    # Running standalone there's no bot flushing usage in the background
+    conn = psycopg.connect(os.getenv("DATABASE_URL"))
+    ensure_usage_schema(conn)
+    usage_tracker.flush(conn)
+    conn.close()
+
+    print("=" * 50)
@@ -0,0 +1,371 @@
+"""
+Outbound message scheduler for the TechSynergy bot.
+
+All replies go through a single dispatcher that respects Telegram's flood
+limits (global and per-chat token buckets), serves user replies ahead of
+admin and bulk traffic, splits messages over the 4096 character limit and
+merges consecutive messages to the same chat into a single API call. Other
+Bot API calls (document uploads, message edits) can be queued with call() so
+they draw from the same buckets.
+"""
+
+import asyncio
+import itertools
+import time
+from collections import deque
+from datetime import timedelta
+
+from telegram.error import RetryAfter
+
+# Telegram limits
+MAX_MESSAGE_LENGTH = 4096
+GLOBAL_RATE = 30      # messages per second across all chats
+GLOBAL_BURST = 30
+CHAT_RATE = 1         # messages per second in a single chat
+CHAT_BURST = 3
+# Flood errors from two different chats this close together mean the bot-wide limit was hit
+GLOBAL_FLOOD_WINDOW = 1.0  # seconds
+
+# Priority lanes (lower is served first)
+PRIORITY_USER = 0
+PRIORITY_ADMIN = 1
+PRIORITY_BULK = 2
+
+# Characters that change meaning when a plain message is sent with a parse mode
+MARKUP_CHARS = {
+    "Markdown": set("*_`["),
+    "HTML": set("<>&"),
+}
+
+
+class TokenBucket:
+    """Token bucket refilled at `rate` tokens per second, holding up to `capacity`"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def pause(self, seconds):
+        """Hand out no tokens for `seconds` (Telegram answered with retry_after)"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self):
+        """Seconds until a token is available (0 if one is available now)"""
+        now = time.monotonic()
+        self._refill(now)
+        paused = max(self.paused_until - now, 0.0)
+        if self.tokens >= 1:
+            return paused
+        return max((1 - self.tokens) / self.rate, paused)
+
+    def consume(self):
+        self._refill(time.monotonic())
+        self.tokens -= 1
+
+    def is_full(self):
+        now = time.monotonic()
+        self._refill(now)
+        return self.tokens >= self.capacity and now >= self.paused_until
+
+
+class OutboundMessage:
+    """A queued message, possibly merged from several send requests"""
+
+    __slots__ = ("chat_id", "text", "priority", "seq", "parse_mode", "reply_markup", "kwargs", "futures", "method")
+
+    def __init__(self, chat_id, text, priority, seq, parse_mode, reply_markup, kwargs, future, method="send_message"):
+        self.method = method
+        self.chat_id = chat_id
+        self.text = text
+        self.priority = priority
+        self.seq = seq
+        self.parse_mode = parse_mode
+        self.reply_markup = reply_markup
+        self.kwargs = kwargs
+        self.futures = [future]
+
+
+def telegram_length(text):
+    """Length as Telegram counts it: UTF-16 code units, so most emoji count twice"""
+    return len(text.encode("utf-16-le")) // 2
+
+
+def _fitting_prefix(text, limit):
+    """Number of characters of text that fit in `limit` UTF-16 units"""
+    units = 0
+    for i, char in enumerate(text):
+        units += 2 if ord(char) > 0xFFFF else 1
+        if units > limit:
+            return i
+    return len(text)
+
+
+def split_text(text, limit=MAX_MESSAGE_LENGTH):
+    """Split text into chunks under `limit` UTF-16 units, preferring line boundaries"""
+    chunks = []
+    while telegram_length(text) > limit:
+        fits = _fitting_prefix(text, limit)
+        cut = text.rfind("\n", 0, fits)
+        if cut <= 0:
+            cut = fits
+        chunks.append(text[:cut])
+        text = text[cut:].lstrip("\n")
+    if text or not chunks:
+        chunks.append(text)
+    return chunks
+
+
+def _merged_parse_mode(first, second):
+    """Return the parse mode to use for two merged messages, or False if they can't be merged"""
+    if first.parse_mode == second.parse_mode:
+        return first.parse_mode
+    if first.parse_mode is None and second.parse_mode in MARKUP_CHARS:
+        if not MARKUP_CHARS[second.parse_mode] & set(first.text):
+            return second.parse_mode
+    if second.parse_mode is None and first.parse_mode in MARKUP_CHARS:
+        if not MARKUP_CHARS[first.parse_mode] & set(second.text):
+            return first.parse_mode
+    return False
+
+
+def retry_after_seconds(error):
+    """Seconds to wait from a RetryAfter error (an int or a timedelta depending on the PTB version)"""
+    retry_after = error.retry_after
+    if isinstance(retry_after, timedelta):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+
+async def _last_result(gathered):
+    return (await gathered)[-1]
+
+
+class OutboundScheduler:
+    """Rate-limited, prioritised sender for outgoing Telegram messages"""
+
+    def __init__(self, global_rate=GLOBAL_RATE, chat_rate=CHAT_RATE):
+        self.bot = None
+        self.global_bucket = TokenBucket(global_rate, GLOBAL_BURST)
+        self.chat_rate = chat_rate
+        self.chat_buckets = {}
+        self.pending = {}          # chat_id -> deque of OutboundMessage (FIFO per chat)
+        self.inflight = set()      # chats with a send currently in progress
+        self.paused_until = 0.0    # set when Telegram's bot-wide flood limit is hit
+        self.last_flood = (None, 0.0)  # (chat_id, monotonic time) of the last retry_after
+        self.api_calls = 0
+        self.messages_sent = 0
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._deliveries = set()   # keeps delivery tasks referenced until they finish
+
+    # === LIFECYCLE ===
+    async def start(self, bot):
+        self.bot = bot
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+        print("✅ Outbound scheduler started")
+
+    async def stop(self, timeout=5):
+        """Give queued messages a moment to drain, then stop the dispatcher"""
+        deadline = time.monotonic() + timeout
+        while (self.pending or self.inflight) and time.monotonic() < deadline:
+            await asyncio.sleep(0.1)
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for task in list(self._deliveries):
+            task.cancel()
+        if self._deliveries:
+            await asyncio.gather(*self._deliveries, return_exceptions=True)
+        for queue in self.pending.values():
+            for item in queue:
+                for future in item.futures:
+                    if not future.done():
+                        future.cancel()
+        self.pending.clear()
+        print(f"🛑 Outbound scheduler stopped ({self.messages_sent} messages in {self.api_calls} API calls)")
+
+    # === QUEUEING ===
+    def enqueue(self, chat_id, text, priority=PRIORITY_USER, parse_mode=None, reply_markup=None, **kwargs):
+        """
+        Queue a message without waiting for it to be sent.
+        Returns a future resolving to the (last) sent telegram Message.
+        """
+        loop = asyncio.get_running_loop()
+        chunks = split_text(text)
+        futures = []
+        queue = self.pending.setdefault(chat_id, deque())
+        for i, chunk in enumerate(chunks):
+            future = loop.create_future()
+            markup = reply_markup if i == len(chunks) - 1 else None
+            item = OutboundMessage(chat_id, chunk, priority, next(self._seq), parse_mode, markup, kwargs, future)
+            if not self._merge_into_tail(queue, item):
+                queue.append(item)
+            futures.append(future)
+        self._wakeup.set()
+
+        result = asyncio.ensure_future(_last_result(asyncio.gather(*futures)))
+        # Fire-and-forget callers shouldn't trigger "exception never retrieved" warnings
+        result.add_done_callback(lambda f: f.cancelled() or f.exception())
+        return result
+
+    async def send(self, chat_id, text, priority=PRIORITY_USER, **kwargs):
+        """Queue a message and wait until it has been delivered"""
+        return await self.enqueue(chat_id, text, priority=priority, **kwargs)
+
+    async def call(self, chat_id, method, priority=PRIORITY_BULK, **kwargs):
+        """
+        Queue another Bot API call for a chat (e.g. "send_document") and wait for its result.
+        File arguments should be paths rather than open files so a retry can re-read them.
+        """
+        future = asyncio.get_running_loop().create_future()
+        item = OutboundMessage(chat_id, None, priority, next(self._seq), None, None, kwargs, future, method=method)
+        self.pending.setdefault(chat_id, deque()).append(item)
+        self._wakeup.set()
+        return await future
+
+    def _merge_into_tail(self, queue, item):
+        """Append item's text to the last queued message for the chat when possible"""
+        if not queue:
+            return False
+        tail = queue[-1]
+        if tail.method != "send_message" or tail.reply_markup is not None or tail.kwargs != item.kwargs:
+            return False
+        parse_mode = _merged_parse_mode(tail, item)
+        if parse_mode is False:
+            return False
+        text = f"{tail.text}\n\n{item.text}"
+        if telegram_length(text) > MAX_MESSAGE_LENGTH:
+            return False
+        tail.text = text
+        tail.parse_mode = parse_mode
+        tail.reply_markup = item.reply_markup
+        tail.priority = min(tail.priority, item.priority)
+        tail.futures.extend(item.futures)
+        return True
+
+    # === DISPATCHING ===
+    def _chat_bucket(self, chat_id):
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self.chat_buckets[chat_id] = TokenBucket(self.chat_rate, CHAT_BURST)
+        return bucket
+
+    def _next_ready(self):
+        """
+        Pick the chat whose head message should be sent next.
+        Returns (chat_id, None) or (None, seconds_to_wait); a wait of None means
+        sleep until something new is queued or a send completes.
+        """
+        if not self.pending:
+            return None, None
+
+        wait = max(self.global_bucket.wait_time(), self.paused_until - time.monotonic())
+        if wait > 0:
+            return None, wait
+
+        best = None
+        min_wait = None
+        for chat_id, queue in self.pending.items():
+            if chat_id in self.inflight:
+                continue
+            chat_wait = self._chat_bucket(chat_id).wait_time()
+            if chat_wait > 0:
+                min_wait = chat_wait if min_wait is None else min(min_wait, chat_wait)
+                continue
+            head = queue[0]
+            if best is None or (head.priority, head.seq) < best[0]:
+                best = ((head.priority, head.seq), chat_id)
+
+        if best is None:
+            return None, min_wait
+        return best[1], None
+
+    async def _run(self):
+        while True:
+            chat_id, wait = self._next_ready()
+            if chat_id is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            queue = self.pending[chat_id]
+            item = queue.popleft()
+            if not queue:
+                del self.pending[chat_id]
+
+            self.global_bucket.consume()
+            self._chat_bucket(chat_id).consume()
+            self.inflight.add(chat_id)
+            task = asyncio.create_task(self._deliver(item))
+            self._deliveries.add(task)
+            task.add_done_callback(self._deliveries.discard)
+            self._forget_idle_buckets()
+
+    async def _deliver(self, item):
+        try:
+            self.api_calls += 1
+            if item.method == "send_message":
+                message = await self.bot.send_message(
+                    chat_id=item.chat_id,
+                    text=item.text,
+                    parse_mode=item.parse_mode,
+                    reply_markup=item.reply_markup,
+                    **item.kwargs
+                )
+            else:
+                message = await getattr(self.bot, item.method)(chat_id=item.chat_id, **item.kwargs)
+            self.messages_sent += len(item.futures)
+            for future in item.futures:
+                if not future.done():
+                    future.set_result(message)
+        except asyncio.CancelledError:
+            for future in item.futures:
+                future.cancel()
+            raise
+        except RetryAfter as e:
+            self._flood_limited(item.chat_id, retry_after_seconds(e))
+            self.pending.setdefault(item.chat_id, deque()).appendleft(item)
+        except Exception as e:
+            print(f"❌ Error sending message to chat {item.chat_id}: {e}")
+            for future in item.futures:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            self.inflight.discard(item.chat_id)
+            self._wakeup.set()
+
+    def _flood_limited(self, chat_id, delay):
+        """Pause the chat that got retry_after; pause everything only if other chats are hitting it too"""
+        now = time.monotonic()
+        last_chat, last_time = self.last_flood
+        self.last_flood = (chat_id, now)
+        self._chat_bucket(chat_id).pause(delay)
+        if last_chat not in (None, chat_id) and now - last_time < GLOBAL_FLOOD_WINDOW:
+            print(f"⏳ Telegram flood limit hit across chats, pausing all sends for {delay}s")
+            self.paused_until = max(self.paused_until, now + delay)
+        else:
+            print(f"⏳ Telegram flood limit hit for chat {chat_id}, retrying in {delay}s")
+
+    def _forget_idle_buckets(self):
+        """Drop per-chat buckets that are full again so the dict doesn't grow forever"""
+        if len(self.chat_buckets) < 1000:
+            return
+        for chat_id in list(self.chat_buckets):
+            if chat_id not in self.pending and chat_id not in self.inflight and self.chat_buckets[chat_id].is_full():
+                del self.chat_buckets[chat_id]
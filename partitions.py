@@ -0,0 +1,276 @@
+"""
+Monthly partitioning and archival for the inquiries table.
+
+The table is range-partitioned on created_at with one partition per month
+(inquiries_yYYYYmMM). Future partitions are created ahead of time, and
+partitions older than the retention window are exported to gzipped CSV,
+detached (and renamed inquiries_archived_yYYYYmMM), and dropped once the
+archive has been uploaded to S3. Uploads that fail are retried on later runs.
+
+Usage: python partitions.py
+"""
+
+import gzip
+import os
+import re
+from datetime import date, datetime
+
+import psycopg
+from dotenv import load_dotenv
+
+from backup import upload_to_s3
+
+# Load environment variables
+load_dotenv()
+
+MONTHS_AHEAD = int(os.getenv("PARTITION_MONTHS_AHEAD", 3))
+RETENTION_MONTHS = int(os.getenv("PARTITION_RETENTION_MONTHS", 12))
+ARCHIVE_DIR = "archives"
+
+PARTITION_NAME = re.compile(r"^inquiries_y(\d{4})m(\d{2})$")
+# Detached partitions are renamed so later runs can find them and retry the upload
+ARCHIVED_PREFIX = "inquiries_archived_"
+
+INQUIRIES_COLUMNS = "id, user_id, username, first_name, last_name, message, response, created_at, status, contact_info"
+
+CREATE_PARTITIONED_TABLE = '''
+    CREATE TABLE IF NOT EXISTS inquiries (
+        id SERIAL,
+        user_id BIGINT,
+        username VARCHAR(255),
+        first_name VARCHAR(255),
+        last_name VARCHAR(255),
+        message TEXT,
+        response TEXT,
+        created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        status VARCHAR(50) DEFAULT 'new',
+        contact_info TEXT,
+        inquiry_key UUID,
+        PRIMARY KEY (id, created_at)
+    ) PARTITION BY RANGE (created_at)
+'''
+
+
+def add_months(month_start, months):
+    """Return the first day of the month `months` away from month_start"""
+    index = month_start.year * 12 + month_start.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def month_of(value):
+    return date(value.year, value.month, 1)
+
+
+def partition_name(month_start):
+    return f"inquiries_y{month_start.year:04d}m{month_start.month:02d}"
+
+
+def is_partitioned(conn):
+    """True if inquiries is a partitioned table, False if it's a plain table, None if missing"""
+    with conn.cursor() as cur:
+        cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('inquiries')")
+        row = cur.fetchone()
+    if row is None:
+        return None
+    return row[0] == 'p'
+
+
+def create_partitioned_table(conn):
+    with conn.cursor() as cur:
+        cur.execute(CREATE_PARTITIONED_TABLE)
+        # Propagates to every partition; keeps "latest N" queries cheap
+        cur.execute("CREATE INDEX IF NOT EXISTS inquiries_created_at_idx ON inquiries (created_at)")
+    conn.commit()
+
+
+def list_partitions(conn):
+    """Return {month_start: partition_name} for the monthly partitions attached to inquiries"""
+    with conn.cursor() as cur:
+        cur.execute('''
+            SELECT c.relname
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = 'inquiries'::regclass
+        ''')
+        names = [row[0] for row in cur.fetchall()]
+
+    partitions = {}
+    for name in names:
+        match = PARTITION_NAME.match(name)
+        if match:
+            partitions[date(int(match.group(1)), int(match.group(2)), 1)] = name
+    return partitions
+
+
+def ensure_partitions(conn, months_ahead=MONTHS_AHEAD, start=None, commit=True):
+    """Create monthly partitions from `start` (default: this month) up to `months_ahead` months ahead"""
+    current = month_of(datetime.now())
+    month = month_of(start) if start else current
+    existing = list_partitions(conn)
+    created = 0
+
+    with conn.cursor() as cur:
+        while month <= add_months(current, months_ahead):
+            if month not in existing:
+                cur.execute(f'''
+                    CREATE TABLE IF NOT EXISTS {partition_name(month)}
+                    PARTITION OF inquiries
+                    FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')
+                ''')
+                created += 1
+            month = add_months(month, 1)
+    if commit:
+        conn.commit()
+
+    if created:
+        print(f"✅ Created {created} inquiries partition(s)")
+    return created
+
+
+def migrate_to_partitioned(conn):
+    """
+    Move rows from a plain inquiries table into the partitioned layout.
+    The old table is kept as inquiries_legacy until it's verified and dropped by hand.
+    """
+    if is_partitioned(conn) is not False:
+        return False
+
+    print("🔄 Migrating inquiries to a partitioned table...")
+    with conn.cursor() as cur:
+        cur.execute("ALTER TABLE inquiries RENAME TO inquiries_legacy")
+        cur.execute("ALTER INDEX IF EXISTS inquiries_pkey RENAME TO inquiries_legacy_pkey")
+        cur.execute("ALTER INDEX IF EXISTS inquiries_created_at_idx RENAME TO inquiries_legacy_created_at_idx")
+        cur.execute("ALTER SEQUENCE IF EXISTS inquiries_id_seq RENAME TO inquiries_legacy_id_seq")
+        cur.execute(CREATE_PARTITIONED_TABLE)
+        cur.execute("CREATE INDEX IF NOT EXISTS inquiries_created_at_idx ON inquiries (created_at)")
+
+        cur.execute("SELECT MIN(created_at) FROM inquiries_legacy")
+        oldest = cur.fetchone()[0]
+
+    # Partitions must exist before rows can be routed into them; everything commits together
+    ensure_partitions(conn, start=oldest, commit=False)
+
+    with conn.cursor() as cur:
+        cur.execute(f'''
+            INSERT INTO inquiries ({INQUIRIES_COLUMNS})
+            SELECT id, user_id, username, first_name, last_name, message, response,
+                   COALESCE(created_at, CURRENT_TIMESTAMP), status, contact_info
+            FROM inquiries_legacy
+        ''')
+        moved = cur.rowcount
+        cur.execute("SELECT setval('inquiries_id_seq', COALESCE((SELECT MAX(id) FROM inquiries), 0) + 1, false)")
+    conn.commit()
+
+    print(f"✅ Migrated {moved} inquiries; old table kept as inquiries_legacy")
+    return True
+
+
+def archived_name(name):
+    return ARCHIVED_PREFIX + name[len("inquiries_"):]
+
+
+def archive_filename(name, archive_dir=ARCHIVE_DIR):
+    """Archive file for a partition, named after the partition whether attached or archived"""
+    if name.startswith(ARCHIVED_PREFIX):
+        name = "inquiries_" + name[len(ARCHIVED_PREFIX):]
+    return os.path.join(archive_dir, f"{name}.csv.gz")
+
+
+def list_archived_tables(conn):
+    """Detached partitions still waiting for their archive to reach S3"""
+    with conn.cursor() as cur:
+        cur.execute('''
+            SELECT relname FROM pg_class
+            WHERE relkind = 'r' AND relname LIKE %s
+            ORDER BY relname
+        ''', (ARCHIVED_PREFIX.replace("_", "\\_") + "%",))
+        return [row[0] for row in cur.fetchall()]
+
+
+def archive_partition(conn, name, archive_dir=ARCHIVE_DIR):
+    """Export one partition (all columns) to a gzipped CSV file and return the filename"""
+    os.makedirs(archive_dir, exist_ok=True)
+    filename = archive_filename(name, archive_dir)
+
+    with conn.cursor() as cur, gzip.open(filename, 'wb') as f:
+        with cur.copy(f"COPY (SELECT * FROM {name} ORDER BY id) TO STDOUT WITH CSV HEADER") as copy:
+            for data in copy:
+                f.write(data)
+
+    print(f"📦 Archived {name} to {filename}")
+    return filename
+
+
+def archive_old_partitions(conn, retention_months=RETENTION_MONTHS, archive_dir=ARCHIVE_DIR):
+    """
+    Export and detach partitions that ended before the retention window.
+    Detached tables are only dropped once the archive has been uploaded to S3,
+    since local disk on Render doesn't survive a redeploy.
+    """
+    cutoff = add_months(month_of(datetime.now()), -retention_months)
+    archived = 0
+
+    for month_start, name in sorted(list_partitions(conn).items()):
+        if add_months(month_start, 1) > cutoff:
+            continue
+        try:
+            archive_partition(conn, name, archive_dir)
+            with conn.cursor() as cur:
+                cur.execute(f"ALTER TABLE inquiries DETACH PARTITION {name}")
+                cur.execute(f"ALTER TABLE {name} RENAME TO {archived_name(name)}")
+            conn.commit()
+            archived += 1
+        except Exception as e:
+            conn.rollback()
+            print(f"❌ Failed to archive {name}: {e}")
+
+    upload_archived_tables(conn, archive_dir)
+    return archived
+
+
+def upload_archived_tables(conn, archive_dir=ARCHIVE_DIR):
+    """
+    Upload the archive of every detached partition and drop the table once it's in S3.
+    The archive is re-exported first if the local file is gone (e.g. after a redeploy).
+    """
+    for name in list_archived_tables(conn):
+        try:
+            filename = archive_filename(name, archive_dir)
+            if not os.path.exists(filename):
+                archive_partition(conn, name, archive_dir)
+
+            if upload_to_s3(filename):
+                with conn.cursor() as cur:
+                    cur.execute(f"DROP TABLE {name}")
+                conn.commit()
+                print(f"🗑️ Dropped {name} after uploading archive")
+            else:
+                print(f"⚠️ Kept detached table {name} - archive not uploaded yet, will retry")
+        except Exception as e:
+            conn.rollback()
+            print(f"❌ Failed to upload archive for {name}: {e}")
+
+
+def maintain_partitions(database_url=None):
+    """Migrate if needed, create upcoming partitions and archive cold ones"""
+    try:
+        conn = psycopg.connect(database_url or os.getenv("DATABASE_URL"))
+        migrate_to_partitioned(conn)
+        ensure_partitions(conn)
+        archived = archive_old_partitions(conn)
+        conn.close()
+        print(f"✅ Partition maintenance done ({archived} partition(s) archived)")
+        return True
+    except Exception as e:
+        print(f"❌ Partition maintenance failed: {e}")
+        return False
+
+
+if __name__ == "__main__":
+    print("=" * 50)
+    print("🗂️ TechSynergy Inquiries Partition Maintenance")
+    print("=" * 50)
+
+    maintain_partitions()
+
+    print("=" * 50)
@@ -0,0 +1,121 @@
+"""
+On-demand sampling profiler.
+
+A background thread snapshots every other thread's Python stack at a fixed
+interval via sys._current_frames() and counts identical stacks. Results can be
+summarised as top functions or written in the folded-stack format that
+flamegraph.pl and speedscope read, with each stack rooted at its thread name.
+Samples of threads parked in an idle wait (the event loop's select, executor
+workers waiting for jobs) are counted separately rather than recorded, so
+they don't drown out the busy stacks. Nothing runs while the profiler is stopped.
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+SAMPLE_INTERVAL = 0.005  # seconds
+
+# (file, function) of leaf frames that mean the thread is blocked waiting for work
+IDLE_LEAVES = {
+    ("selectors.py", "select"),
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"),  # ThreadPoolExecutor worker blocked on its SimpleQueue
+}
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def _is_idle(frame):
+    code = frame.f_code
+    return (os.path.basename(code.co_filename), code.co_name) in IDLE_LEAVES
+
+
+class SamplingProfiler:
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self.idle = 0
+        self.started = None
+        self.elapsed = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self):
+        if self.running:
+            raise RuntimeError("profiler is already running")
+        self.stacks = Counter()
+        self.samples = 0
+        self.idle = 0
+        self.started = time.monotonic()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if not self.running:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        self.elapsed = time.monotonic() - self.started
+
+    def _run(self):
+        own_id = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                if _is_idle(frame):
+                    self.idle += 1
+                    continue
+                if thread_id not in names:
+                    names = {thread.ident: thread.name for thread in threading.enumerate()}
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, f"thread-{thread_id}"))
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def top_functions(self, limit=15):
+        """Return [(function, self_samples, total_samples)] sorted by self time"""
+        own = Counter()
+        total = Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(";")[1:]  # drop the thread name
+            own[frames[-1]] += count
+            for label in set(frames):
+                total[label] += count
+        return [(label, count, total[label]) for label, count in own.most_common(limit)]
+
+    def summary(self, limit=15):
+        stack_samples = sum(self.stacks.values()) or 1
+        lines = [
+            f"🔬 Profile: {self.samples} samples over {self.elapsed:.1f}s ({self.idle} idle thread samples skipped)",
+            "self% total% function",
+        ]
+        for label, own, total in self.top_functions(limit):
+            lines.append(f"{own * 100 / stack_samples:5.1f} {total * 100 / stack_samples:5.1f} {label}")
+        return "\n".join(lines)
+
+    def write_folded(self, filename):
+        """Write stacks in folded format (one 'thread;a;b;c count' line per stack) for flamegraph tools"""
+        with open(filename, 'w', encoding='utf-8') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        return filename
@@ -4,7 +4,12 @@ import psycopg
 import smtplib
 import re
 import asyncio
-from datetime import datetime
+import time
+import shutil
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from pathlib import Path
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from telegram import Update, ReplyKeyboardMarkup
@@ -16,6 +21,15 @@ from telegram.ext import (
     filters,
 )
 import openai
+from outbound import OutboundScheduler, PRIORITY_USER, PRIORITY_ADMIN, PRIORITY_BULK
+from contacts import contains_contact_info, first_email
+from lead_enrichment import enrich_pending_leads, ensure_enrichment_schema
+from usage import usage_tracker, ensure_usage_schema, estimate_cost, DEGRADED_MAX_TOKENS
+from backup import export_inquiries, EXPORT_FORMATS
+from tracing import tracer, span, format_trace
+from profiler import SamplingProfiler
+from journal import inquiry_journal, FSYNC_INTERVAL
+from partitions import is_partitioned, create_partitioned_table, migrate_to_partitioned, ensure_partitions
 
 # Set up logging
 logging.basicConfig(
@@ -52,37 +66,44 @@ ADMIN_USER_ID = 6347949152  # ⚠️ CHANGE THIS TO YOUR TELEGRAM USER ID
 # Configure OpenAI (v0.28.1)
 openai.api_key = OPENAI_API_KEY
 
+# === OUTBOUND MESSAGES ===
+# Every reply goes through the scheduler so we stay under Telegram's flood limits
+outbound = OutboundScheduler()
+
+async def reply(update: Update, text: str, priority=PRIORITY_USER, **kwargs):
+    """
+    Queue a message to the update's chat through the outbound scheduler and return
+    without waiting for delivery, so a rate-limited chat doesn't hold up other updates.
+    Returns a future for the sent Message; await it only when the Message is needed.
+    """
+    return outbound.enqueue(update.effective_chat.id, text, priority=priority, **kwargs)
+
 # Database connection
-def get_db_connection():
-    return psycopg.connect(DATABASE_URL)
+DB_CONNECT_TIMEOUT = int(os.getenv("DB_CONNECT_TIMEOUT", 10))  # seconds
+DB_STATEMENT_TIMEOUT = int(os.getenv("DB_STATEMENT_TIMEOUT", 5000))  # milliseconds, request path only
+
+def get_db_connection(statement_timeout=None):
+    """Open a connection; statement_timeout (ms) caps each query so a stalled server can't hang a request"""
+    options = f"-c statement_timeout={statement_timeout}" if statement_timeout else None
+    return psycopg.connect(DATABASE_URL, connect_timeout=DB_CONNECT_TIMEOUT, options=options)
 
 def create_inquiries_table():
     try:
         conn = get_db_connection()
-        with conn.cursor() as cur:
-            cur.execute('''
-                CREATE TABLE IF NOT EXISTS inquiries (
-                    id SERIAL PRIMARY KEY,
-                    user_id BIGINT,
-                    username VARCHAR(255),
-                    first_name VARCHAR(255),
-                    last_name VARCHAR(255),
-                    message TEXT,
-                    response TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    status VARCHAR(50) DEFAULT 'new',
-                    contact_info TEXT
-                )
-            ''')
-        conn.commit()
+        # Existing plain tables are migrated by prepare_partitions()
+        if is_partitioned(conn) is None:
+            create_partitioned_table(conn)
         conn.close()
         print("✅ Database table created successfully")
     except Exception as e:
         print(f"❌ Error creating table: {e}")
 
 # === ADD THIS NEW FUNCTION ===
+inquiries_schema_ready = False
+
 def update_table_schema():
     """Update existing table to add missing columns"""
+    global inquiries_schema_ready
     try:
         conn = get_db_connection()
         with conn.cursor() as cur:
@@ -109,11 +130,125 @@ def update_table_schema():
                 cur.execute("ALTER TABLE inquiries ADD COLUMN status VARCHAR(50) DEFAULT 'new'")
                 conn.commit()
                 print("✅ Successfully added 'status' column")
+            
+            # Check if inquiry_key column exists (links usage rows to the inquiry)
+            cur.execute('''
+                SELECT column_name 
+                FROM information_schema.columns 
+                WHERE table_name='inquiries' and column_name='inquiry_key'
+            ''')
+            if not cur.fetchone():
+                print("🔄 Adding missing 'inquiry_key' column to inquiries table...")
+                cur.execute('ALTER TABLE inquiries ADD COLUMN inquiry_key UUID')
+                conn.commit()
+                print("✅ Successfully added 'inquiry_key' column")
                 
         conn.close()
+        inquiries_schema_ready = True
     except Exception as e:
         print(f"❌ Error updating table schema: {e}")
 
+# === PARTITION MAINTENANCE ===
+def prepare_partitions():
+    """Migrate a plain inquiries table to monthly partitions and create upcoming ones"""
+    try:
+        conn = get_db_connection()
+        migrate_to_partitioned(conn)
+        ensure_partitions(conn)
+        conn.close()
+    except Exception as e:
+        print(f"❌ Error preparing partitions: {e}")
+
+async def partition_maintenance_loop():
+    """Keep future partitions created while the bot runs; archival runs as a cron job"""
+    while True:
+        await asyncio.sleep(24 * 60 * 60)
+        await asyncio.to_thread(prepare_partitions)
+
+# === LEAD ENRICHMENT ===
+ENRICHMENT_INTERVAL = int(os.getenv("ENRICHMENT_INTERVAL", 600))  # seconds
+
+def prepare_lead_enrichment():
+    """Add the enrichment columns once at startup rather than on every pass"""
+    try:
+        conn = get_db_connection()
+        ensure_enrichment_schema(conn)
+        conn.close()
+    except Exception as e:
+        print(f"❌ Error preparing lead enrichment: {e}")
+
+async def lead_enrichment_loop():
+    """Periodically score new inquiries in batches without blocking the event loop"""
+    while True:
+        await asyncio.sleep(ENRICHMENT_INTERVAL)
+        await asyncio.to_thread(enrich_pending_leads, DATABASE_URL)
+
+# === INQUIRY JOURNAL ===
+JOURNAL_REPLAY_INTERVAL = int(os.getenv("JOURNAL_REPLAY_INTERVAL", 30))  # seconds
+
+def replay_journal():
+    """Load journaled inquiries into the database once it's reachable again"""
+    if not inquiry_journal.has_pending():
+        return
+    if not inquiries_schema_ready:
+        # The database was down at startup; replaying into an outdated table would quarantine everything
+        create_inquiries_table()
+        update_table_schema()
+        if not inquiries_schema_ready:
+            return
+    conn = None
+    try:
+        conn = get_db_connection()
+        inquiry_journal.replay(conn)
+    except psycopg.OperationalError as e:
+        inquiry_journal.mark_db_down()
+        print(f"❌ Journal replay failed, database unavailable, will retry: {e}")
+    except Exception as e:
+        print(f"❌ Journal replay failed, will retry: {e}")
+    finally:
+        if conn is not None:
+            conn.close()
+
+async def journal_loop():
+    """fsync journal batches every second and replay the journal periodically"""
+    last_replay = 0.0
+    while True:
+        await asyncio.sleep(FSYNC_INTERVAL)
+        if inquiry_journal.unsynced:
+            await asyncio.to_thread(inquiry_journal.sync)
+        if time.monotonic() - last_replay >= JOURNAL_REPLAY_INTERVAL:
+            last_replay = time.monotonic()
+            await asyncio.to_thread(replay_journal)
+
+# === USAGE ACCOUNTING ===
+CHAT_MODEL = "gpt-3.5-turbo"
+CHAT_MAX_TOKENS = 500
+USAGE_FLUSH_INTERVAL = int(os.getenv("USAGE_FLUSH_INTERVAL", 30))  # seconds
+
+def prepare_usage_tracking():
+    """Create usage tables and restore today's budget counters"""
+    try:
+        conn = get_db_connection()
+        ensure_usage_schema(conn)
+        usage_tracker.load_today(conn)
+        conn.close()
+    except Exception as e:
+        print(f"❌ Error preparing usage tracking: {e}")
+
+def flush_usage():
+    try:
+        conn = get_db_connection()
+        usage_tracker.flush(conn)
+        conn.close()
+    except Exception as e:
+        print(f"❌ Error flushing usage: {e}")
+
+async def usage_flush_loop():
+    """Write recorded completions to the database in batches"""
+    while True:
+        await asyncio.sleep(USAGE_FLUSH_INTERVAL)
+        await asyncio.to_thread(flush_usage)
+
 # === BACKUP FUNCTIONS ===
 def backup_inquiries():
     """Backup all inquiries to a CSV file"""
@@ -215,29 +350,120 @@ def export_recent_inquiries(days=7):
 # === BACKUP COMMAND ===
 async def backup_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.effective_user.id != ADMIN_USER_ID:
-        await update.message.reply_text("❌ Access denied.")
+        await reply(update, "❌ Access denied.")
         return
     
     try:
-        await update.message.reply_text("🔄 Starting database backup...")
+        await reply(update, "🔄 Starting database backup...", priority=PRIORITY_ADMIN)
         
-        # Run backups
-        backup_success = backup_inquiries()
-        export_success = export_recent_inquiries(7)
+        # Run backups off the event loop so other chats aren't held up
+        backup_success = await asyncio.to_thread(backup_inquiries)
+        export_success = await asyncio.to_thread(export_recent_inquiries, 7)
         
         if backup_success:
             message = "✅ Backup completed successfully!\n"
             message += "• Full database backup created\n"
             if export_success:
                 message += "• Recent inquiries exported\n"
-            message += "📁 Check Render logs for file details"
+            message += "📁 Use /export to receive the data as a file"
         else:
             message = "❌ Backup failed. Check logs for details."
         
-        await update.message.reply_text(message)
+        await reply(update, message, priority=PRIORITY_ADMIN)
+        
+    except Exception as e:
+        await reply(update, f"❌ Backup error: {e}", priority=PRIORITY_ADMIN)
+
+# === EXPORT COMMAND ===
+# Dedicated pool so a large export never starves the default to_thread() workers
+export_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="export")
+EXPORT_PROGRESS_INTERVAL = 3  # seconds between progress updates
+EXPORT_USAGE = "❌ Usage: /export [csv|jsonl] [YYYY-MM-DD] [YYYY-MM-DD]"
+
+def parse_export_args(args):
+    """Parse `/export [csv|jsonl] [start] [end]` into (format, start, end); raises ValueError"""
+    fmt = "csv"
+    dates = []
+    for arg in args:
+        if arg.lower() in EXPORT_FORMATS:
+            fmt = arg.lower()
+        else:
+            dates.append(datetime.strptime(arg, "%Y-%m-%d").date())
+    
+    if len(dates) > 2:
+        raise ValueError("too many dates")
+    start = dates[0] if dates else None
+    end = dates[1] if len(dates) > 1 else None
+    if start and end and start > end:
+        raise ValueError("start date is after end date")
+    return fmt, start, end
+
+async def send_export_document(chat_id, filename, caption):
+    """Upload a file through the outbound scheduler so it shares the flood-limit buckets"""
+    return await outbound.call(
+        chat_id,
+        "send_document",
+        priority=PRIORITY_BULK,
+        document=Path(filename),
+        filename=os.path.basename(filename),
+        caption=caption
+    )
+
+async def export_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id != ADMIN_USER_ID:
+        await reply(update, "❌ Access denied.")
+        return
+    
+    try:
+        fmt, start, end = parse_export_args(context.args)
+    except ValueError:
+        await reply(update, EXPORT_USAGE, priority=PRIORITY_ADMIN)
+        return
+    
+    parts = []
+    try:
+        status = await outbound.send(update.effective_chat.id, f"🔄 Preparing {fmt.upper()} export...", priority=PRIORITY_ADMIN)
+        
+        # Generate the file in a worker thread and report progress while it runs
+        progress = {}
+        loop = asyncio.get_running_loop()
+        job = loop.run_in_executor(export_executor, export_inquiries, fmt, start, end, progress)
+        last_text = None
+        while True:
+            done, _ = await asyncio.wait({job}, timeout=EXPORT_PROGRESS_INTERVAL)
+            if done:
+                break
+            text = f"⏳ Exporting... {progress.get('rows', 0)}/{progress.get('total', 0)} inquiries"
+            if text != last_text:
+                try:
+                    await outbound.call(
+                        status.chat_id, "edit_message_text", priority=PRIORITY_BULK,
+                        text=text, message_id=status.message_id
+                    )
+                    last_text = text
+                except Exception as e:
+                    print(f"⚠️ Could not update export progress: {e}")
+        parts = job.result()
+        
+        if not parts:
+            await reply(update, "📭 No inquiries in that date range.", priority=PRIORITY_ADMIN)
+            return
+        
+        for i, filename in enumerate(parts, 1):
+            caption = f"📦 Part {i}/{len(parts)}" if len(parts) > 1 else None
+            await send_export_document(update.effective_chat.id, filename, caption)
+        
+        await reply(
+            update,
+            f"✅ Export complete: {progress['rows']} inquiries in {len(parts)} file(s)",
+            priority=PRIORITY_ADMIN
+        )
         
     except Exception as e:
-        await update.message.reply_text(f"❌ Backup error: {e}")
+        await reply(update, f"❌ Export error: {e}", priority=PRIORITY_ADMIN)
+    finally:
+        if parts:
+            shutil.rmtree(os.path.dirname(parts[0]), ignore_errors=True)
 
 # === INPUT VALIDATION FUNCTIONS ===
 def is_valid_email(email):
@@ -249,16 +475,6 @@ def is_valid_phone(phone):
     pattern = r'^[\+]?[0-9\s\-\(\)]{10,}$'
     return re.match(pattern, phone) is not None
 
-def contains_contact_info(message):
-    """Check if message contains email or phone number"""
-    email_pattern = r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b'
-    phone_pattern = r'[\+]?[0-9\s\-\(\)]{10,}'
-    
-    has_email = re.search(email_pattern, message) is not None
-    has_phone = re.search(phone_pattern, message) is not None
-    
-    return has_email or has_phone, has_email, has_phone
-
 # === EMAIL NOTIFICATION FUNCTION ===
 def send_inquiry_notification(user_info, user_message, bot_response, contact_detected=False):
     if not all([EMAIL_USER, EMAIL_PASSWORD, NOTIFY_EMAIL]):
@@ -307,32 +523,62 @@ def send_inquiry_notification(user_info, user_message, bot_response, contact_det
     except Exception as e:
         print(f"❌ Error sending email: {e}")
 
-def save_inquiry(update: Update, user_message: str, bot_response: str):
+def save_inquiry(update: Update, user_message: str, bot_response: str, inquiry_key=None):
     try:
-        contact_detected, has_email, has_phone = contains_contact_info(user_message)
-        contact_info = ""
+        with span("contact_regex"):
+            contact_detected, has_email, has_phone = contains_contact_info(user_message)
+            contact_info = ""
+            
+            if has_email:
+                contact_info = f"Email: {first_email(user_message)}"
         
-        if has_email:
-            email_match = re.search(r'\b[A-Za-z0-9._%+-]+@[A-Za-z0-9.-]+\.[A-Z|a-z]{2,}\b', user_message)
-            if email_match:
-                contact_info = f"Email: {email_match.group()}"
+        saved = False
+        if not inquiry_journal.db_suspect():
+            with span("db_insert"):
+                conn = None
+                try:
+                    conn = get_db_connection(statement_timeout=DB_STATEMENT_TIMEOUT)
+                    with conn.cursor() as cur:
+                        cur.execute('''
+                            INSERT INTO inquiries (inquiry_key, user_id, username, first_name, last_name,
+                                                   message, response, contact_info)
+                            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                        ''', (
+                            inquiry_key,
+                            update.effective_user.id,
+                            update.effective_user.username,
+                            update.effective_user.first_name,
+                            update.effective_user.last_name or '',
+                            user_message,
+                            bot_response,
+                            contact_info
+                        ))
+                    conn.commit()
+                    saved = True
+                except psycopg.OperationalError as e:
+                    # Connection failures and statement timeouts: stop trying the database for a while
+                    inquiry_journal.mark_db_down()
+                    print(f"⚠️ Database unavailable, journaling inquiry: {e}")
+                except psycopg.Error as e:
+                    print(f"⚠️ Could not save inquiry, journaling it: {e}")
+                finally:
+                    if conn is not None:
+                        conn.close()
         
-        conn = get_db_connection()
-        with conn.cursor() as cur:
-            cur.execute('''
-                INSERT INTO inquiries (user_id, username, first_name, last_name, message, response, contact_info)
-                VALUES (%s, %s, %s, %s, %s, %s, %s)
-            ''', (
-                update.effective_user.id,
-                update.effective_user.username,
-                update.effective_user.first_name,
-                update.effective_user.last_name or '',
-                user_message,
-                bot_response,
-                contact_info
-            ))
-        conn.commit()
-        conn.close()
+        # The user has been told we'll be in touch, so the lead must not be lost
+        if not saved:
+            with span("journal_append"):
+                inquiry_journal.append({
+                    'inquiry_key': inquiry_key,
+                    'user_id': update.effective_user.id,
+                    'username': update.effective_user.username,
+                    'first_name': update.effective_user.first_name,
+                    'last_name': update.effective_user.last_name or '',
+                    'message': user_message,
+                    'response': bot_response,
+                    'contact_info': contact_info,
+                    'created_at': datetime.now()
+                })
         
         # Send email notification
         user_info = {
@@ -341,7 +587,8 @@ def save_inquiry(update: Update, user_message: str, bot_response: str):
             'first_name': update.effective_user.first_name,
             'last_name': update.effective_user.last_name or ''
         }
-        send_inquiry_notification(user_info, user_message, bot_response, contact_detected)
+        with span("smtp"):
+            send_inquiry_notification(user_info, user_message, bot_response, contact_detected)
         
         print(f"✅ Inquiry saved for user {update.effective_user.first_name}")
         return True
@@ -352,6 +599,9 @@ def save_inquiry(update: Update, user_message: str, bot_response: str):
 # Initialize database on startup
 create_inquiries_table()
 update_table_schema()  # ⚠️ ADD THIS LINE to update existing table
+prepare_partitions()
+prepare_usage_tracking()
+prepare_lead_enrichment()
 
 # === Custom Keyboard Menu ===
 main_menu = ReplyKeyboardMarkup(
@@ -372,14 +622,16 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "a leading provider of IT solutions, digital innovation, and technology consultancy.\n\n"
         "You can use the menu below or type your question to begin."
     )
-    await update.message.reply_text(
+    await reply(
+        update,
         welcome_message,
         parse_mode="Markdown",
         reply_markup=main_menu
     )
 
 async def about(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text(
+    await reply(
+        update,
         "💼 *About TechSynergy Solutions Limited*\n\n"
         "TechSynergy Solutions is a full-service IT and innovation company providing professional services in:\n"
         "🌐 Web & Software Development\n"
@@ -393,7 +645,8 @@ async def about(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 async def services(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text(
+    await reply(
+        update,
         "🧠 *Our Core Services Include:*\n\n"
         "1️⃣ Web & Software Development\n"
         "2️⃣ Mobile App Development\n"
@@ -415,10 +668,11 @@ async def contact(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "☎️ Phone: +234 816 035 7708\n\n"
         "💡 *Pro Tip:* Include your email or phone number in your message for faster follow-up!"
     )
-    await update.message.reply_text(contact_message, parse_mode="Markdown")
+    await reply(update, contact_message, parse_mode="Markdown")
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text(
+    await reply(
+        update,
         "🆘 *Help Menu*\n\n"
         "Use the menu below or type:\n"
         "/about - Learn about TechSynergy\n"
@@ -437,11 +691,11 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # Input validation
     if not user_message or len(user_message) < 2:
-        await update.message.reply_text("❌ Please provide a meaningful message (at least 2 characters).")
+        await reply(update, "❌ Please provide a meaningful message (at least 2 characters).")
         return
 
     if len(user_message) > 1000:
-        await update.message.reply_text("❌ Message too long. Please keep it under 1000 characters.")
+        await reply(update, "❌ Message too long. Please keep it under 1000 characters.")
         return
 
     # Map button text to commands
@@ -456,7 +710,8 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     try:
         # Show typing action
-        await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
+        with span("telegram_typing"):
+            await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="typing")
         
         # Enhanced system prompt to encourage contact info
         system_prompt = """You are TechSynergy AI Assistant. When users inquire about services:
@@ -466,48 +721,71 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         4. Mention that our team will contact them promptly
         5. Keep responses concise but thorough"""
         
-        # Use OpenAI client (v0.28.1 syntax)
-        response = openai.ChatCompletion.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_message},
-            ],
-            max_tokens=500,
-            temperature=0.7
-        )
+        # Over budget: reuse a cached answer if we have one, otherwise ask for a shorter reply
+        user_id = update.effective_user.id
+        # Ties this turn's usage rows to the inquiry row that save_inquiry writes
+        inquiry_key = str(uuid.uuid4())
+        over_budget = usage_tracker.over_budget(user_id)
+        bot_response = usage_tracker.cached_answer(user_message) if over_budget else None
 
-        bot_response = response.choices[0].message.content.strip()
+        if bot_response:
+            usage_tracker.record(user_id, CHAT_MODEL, 0, 0, 0, cached=True, inquiry_key=inquiry_key)
+        else:
+            # Use OpenAI client (v0.28.1 syntax)
+            started = time.monotonic()
+            with span("openai", model=CHAT_MODEL):
+                response = openai.ChatCompletion.create(
+                    model=CHAT_MODEL,
+                    messages=[
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": user_message},
+                    ],
+                    max_tokens=DEGRADED_MAX_TOKENS if over_budget else CHAT_MAX_TOKENS,
+                    temperature=0.7
+                )
+            usage_tracker.record_completion(
+                response, user_id, CHAT_MODEL, (time.monotonic() - started) * 1000, inquiry_key=inquiry_key
+            )
+
+            bot_response = response.choices[0].message.content.strip()
+            if not over_budget:
+                usage_tracker.remember_answer(user_message, bot_response)
         
         # Save inquiry to database
-        save_success = save_inquiry(update, user_message, bot_response)
+        with span("save_inquiry"):
+            save_success = await asyncio.to_thread(save_inquiry, update, user_message, bot_response, inquiry_key)
         
         # Send confirmation message to user
-        contact_detected, _, _ = contains_contact_info(user_message)
+        with span("contact_regex"):
+            contact_detected, _, _ = contains_contact_info(user_message)
         
         if contact_detected:
             confirmation = "✅ Thank you! Your project details and contact information have been received. Our TechSynergy team will contact you soon!"
         else:
             confirmation = "✅ Thank you for your inquiry! For faster follow-up, please share your email or phone number so our team can contact you directly."
         
-        await update.message.reply_text(bot_response, parse_mode="Markdown")
-        await update.message.reply_text(confirmation)
+        # Queue all replies together so the scheduler can merge them into one API call;
+        # the handler returns without waiting for Telegram to deliver them
+        chat_id = update.effective_chat.id
+        outbound.enqueue(chat_id, bot_response, parse_mode="Markdown")
+        outbound.enqueue(chat_id, confirmation)
         
         # Additional prompt for contact info if not provided
         if not contact_detected and any(word in user_message.lower() for word in ['website', 'app', 'development', 'project', 'service', 'quote']):
-            await update.message.reply_text(
+            outbound.enqueue(
+                chat_id,
                 "📧 *Quick Follow-up:* Could you share your email or phone number so we can discuss your project in more detail?",
                 parse_mode="Markdown"
             )
 
     except Exception as e:
         print(f"OpenAI Error: {e}")
-        await update.message.reply_text("⚠️ Sorry, I'm having trouble connecting to our AI service. Please try again in a moment.")
+        await reply(update, "⚠️ Sorry, I'm having trouble connecting to our AI service. Please try again in a moment.")
 
 # === ENHANCED ADMIN COMMANDS ===
 async def view_inquiries(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.effective_user.id != ADMIN_USER_ID:
-        await update.message.reply_text("❌ Access denied.")
+        await reply(update, "❌ Access denied.")
         return
     
     try:
@@ -523,7 +801,7 @@ async def view_inquiries(update: Update, context: ContextTypes.DEFAULT_TYPE):
         conn.close()
         
         if not inquiries:
-            await update.message.reply_text("📭 No inquiries yet.")
+            await reply(update, "📭 No inquiries yet.", priority=PRIORITY_ADMIN)
             return
         
         response = "📋 *Recent Inquiries (Last 10):*\n\n"
@@ -536,14 +814,14 @@ async def view_inquiries(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 response += f"📞 {inquiry[5]}\n"
             response += "─" * 30 + "\n"
         
-        await update.message.reply_text(response, parse_mode="Markdown")
+        await reply(update, response, parse_mode="Markdown", priority=PRIORITY_ADMIN)
         
     except Exception as e:
-        await update.message.reply_text(f"❌ Error fetching inquiries: {e}")
+        await reply(update, f"❌ Error fetching inquiries: {e}", priority=PRIORITY_ADMIN)
 
 async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.effective_user.id != ADMIN_USER_ID:
-        await update.message.reply_text("❌ Access denied.")
+        await reply(update, "❌ Access denied.")
         return
     
     try:
@@ -553,8 +831,8 @@ async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
             cur.execute('SELECT COUNT(*) FROM inquiries')
             total = cur.fetchone()[0]
             
-            # Today's inquiries
-            cur.execute("SELECT COUNT(*) FROM inquiries WHERE DATE(created_at) = CURRENT_DATE")
+            # Today's inquiries (range condition, not DATE(), so only this month's partition is scanned)
+            cur.execute("SELECT COUNT(*) FROM inquiries WHERE created_at >= CURRENT_DATE AND created_at < CURRENT_DATE + INTERVAL '1 day'")
             today = cur.fetchone()[0]
             
             # Inquiries with contact info
@@ -575,33 +853,185 @@ async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
         for status, count in status_counts:
             response += f"• {status}: {count}\n"
         
-        await update.message.reply_text(response, parse_mode="Markdown")
+        await reply(update, response, parse_mode="Markdown", priority=PRIORITY_ADMIN)
         
     except Exception as e:
-        await update.message.reply_text(f"❌ Error fetching stats: {e}")
+        await reply(update, f"❌ Error fetching stats: {e}", priority=PRIORITY_ADMIN)
+
+async def usage_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id != ADMIN_USER_ID:
+        await reply(update, "❌ Access denied.")
+        return
+    
+    try:
+        # Make sure the latest completions are in the rollups before reading them
+        await asyncio.to_thread(flush_usage)
+        
+        conn = get_db_connection()
+        with conn.cursor() as cur:
+            # Daily totals for the last 7 days
+            cur.execute('''
+                SELECT day, model, SUM(requests), SUM(cached_requests),
+                       SUM(prompt_tokens), SUM(completion_tokens), SUM(latency_ms)
+                FROM usage_daily
+                WHERE day >= %s
+                GROUP BY day, model
+                ORDER BY day DESC
+            ''', (datetime.now().date() - timedelta(days=6),))
+            daily = cur.fetchall()
+            
+            # Heaviest users today
+            cur.execute('''
+                SELECT user_id, SUM(prompt_tokens + completion_tokens) AS tokens
+                FROM usage_daily
+                WHERE day = %s AND user_id != 0
+                GROUP BY user_id
+                ORDER BY tokens DESC
+                LIMIT 5
+            ''', (datetime.now().date(),))
+            top_users = cur.fetchall()
+        conn.close()
+        
+        if not daily:
+            await reply(update, "📭 No usage recorded yet.", priority=PRIORITY_ADMIN)
+            return
+        
+        response = "💰 *Token Usage (Last 7 Days)*\n\n"
+        for day, model, requests, cached, prompt, completion, latency in daily:
+            cost = estimate_cost(model, prompt, completion)
+            avg_latency = latency / max(requests - cached, 1)
+            response += f"📅 {day.strftime('%m/%d')} {model}\n"
+            response += f"• Requests: {requests} ({cached} cached)\n"
+            response += f"• Tokens: {prompt} in / {completion} out\n"
+            response += f"• Cost: ${cost:.4f} | Avg latency: {avg_latency:.0f}ms\n"
+        
+        response += "\n🎯 *Budgets*\n"
+        response += f"• Today: {usage_tracker.tokens_today} / {usage_tracker.daily_budget or '∞'} tokens\n"
+        response += f"• Per user: {usage_tracker.user_budget or '∞'} tokens\n"
+        
+        if top_users:
+            response += "\n👥 *Top Users Today*\n"
+            for user_id, tokens in top_users:
+                response += f"• {user_id}: {tokens} tokens\n"
+        
+        await reply(update, response, parse_mode="Markdown", priority=PRIORITY_ADMIN)
+        
+    except Exception as e:
+        await reply(update, f"❌ Error fetching usage: {e}", priority=PRIORITY_ADMIN)
+
+# === DIAGNOSTICS ===
+PROFILE_DEFAULT_SECONDS = 10
+PROFILE_MAX_SECONDS = 120
+profiler = SamplingProfiler()
+
+async def traces_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id != ADMIN_USER_ID:
+        await reply(update, "❌ Access denied.")
+        return
+    
+    slow = list(tracer.slow_traces)[-5:]
+    if not slow:
+        await reply(
+            update,
+            f"🐢 No updates slower than {tracer.slow_ms}ms ({tracer.traced} traced).",
+            priority=PRIORITY_ADMIN
+        )
+        return
+    
+    # Plain text: span names contain underscores that Markdown would eat
+    response = f"🐢 Slowest recent updates (>{tracer.slow_ms}ms, {tracer.traced} traced):\n\n"
+    for root in reversed(slow):
+        response += f"⏰ {root.started_at.strftime('%m/%d %H:%M:%S')}\n"
+        response += format_trace(root) + "\n"
+        response += "─" * 30 + "\n"
+    
+    await reply(update, response, priority=PRIORITY_ADMIN)
+
+async def profile_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id != ADMIN_USER_ID:
+        await reply(update, "❌ Access denied.")
+        return
+    
+    try:
+        seconds = int(context.args[0]) if context.args else PROFILE_DEFAULT_SECONDS
+    except ValueError:
+        await reply(update, "❌ Usage: /profile <seconds>", priority=PRIORITY_ADMIN)
+        return
+    seconds = max(1, min(seconds, PROFILE_MAX_SECONDS))
+    
+    if profiler.running:
+        await reply(update, "⚠️ A profile is already running.", priority=PRIORITY_ADMIN)
+        return
+    
+    filename = None
+    try:
+        await reply(update, f"🔬 Profiling for {seconds}s...", priority=PRIORITY_ADMIN)
+        profiler.start()
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profiler.stop()
+        
+        await reply(update, profiler.summary(), priority=PRIORITY_ADMIN)
+        
+        filename = profiler.write_folded(f"profile_{datetime.now():%Y%m%d_%H%M%S}.folded")
+        await send_export_document(
+            update.effective_chat.id, filename, "🔥 Folded stacks for flamegraph.pl / speedscope"
+        )
+        
+    except Exception as e:
+        await reply(update, f"❌ Profiling error: {e}", priority=PRIORITY_ADMIN)
+    finally:
+        if filename and os.path.exists(filename):
+            os.remove(filename)
 
 # === Error Handler ===
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Log errors caused by Updates."""
     print(f"Update {update} caused error {context.error}")
 
+# === Lifecycle Hooks ===
+async def post_init(application: Application):
+    await outbound.start(application.bot)
+    application.create_task(partition_maintenance_loop())
+    application.create_task(lead_enrichment_loop())
+    application.create_task(usage_flush_loop())
+    application.create_task(journal_loop())
+
+async def post_shutdown(application: Application):
+    await outbound.stop()
+    await asyncio.to_thread(flush_usage)
+    inquiry_journal.close()
+
 # === Main Function ===
 def main():
     print("🤖 TechSynergy AI Bot is starting...")
     
     # Create Application instance
-    application = Application.builder().token(BOT_TOKEN).build()
+    application = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
 
     # Add handlers
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(CommandHandler("about", about))
-    application.add_handler(CommandHandler("services", services))
-    application.add_handler(CommandHandler("contact", contact))
-    application.add_handler(CommandHandler("help", help_command))
-    application.add_handler(CommandHandler("inquiries", view_inquiries))
-    application.add_handler(CommandHandler("stats", stats))
-    application.add_handler(CommandHandler("backup", backup_command))
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
+    # Every handler is wrapped so each update gets a trace (see /traces)
+    application.add_handler(CommandHandler("start", tracer.wrap(start)))
+    application.add_handler(CommandHandler("about", tracer.wrap(about)))
+    application.add_handler(CommandHandler("services", tracer.wrap(services)))
+    application.add_handler(CommandHandler("contact", tracer.wrap(contact)))
+    application.add_handler(CommandHandler("help", tracer.wrap(help_command)))
+    application.add_handler(CommandHandler("inquiries", tracer.wrap(view_inquiries)))
+    application.add_handler(CommandHandler("stats", tracer.wrap(stats)))
+    application.add_handler(CommandHandler("backup", tracer.wrap(backup_command)))
+    application.add_handler(CommandHandler("usage", tracer.wrap(usage_command)))
+    # Non-blocking so updates from other users keep being processed during a long export or profile
+    application.add_handler(CommandHandler("export", export_command, block=False))
+    application.add_handler(CommandHandler("traces", traces_command))
+    application.add_handler(CommandHandler("profile", profile_command, block=False))
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, tracer.wrap(handle_message)))
     
     # Add error handler
     application.add_error_handler(error_handler)
@@ -0,0 +1,113 @@
+"""
+Lightweight per-update tracing.
+
+Each handled update opens a root trace; code inside it opens child spans with
+`span("name")` for the stages we care about (OpenAI, database, SMTP, Telegram).
+Spans follow the current context, so they work across awaits and inside
+asyncio.to_thread(). Outside a trace `span()` is a single ContextVar lookup.
+Traces slower than SLOW_TRACE_MS are kept in a bounded ring buffer for /traces.
+"""
+
+import contextvars
+import functools
+import os
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+
+SLOW_TRACE_MS = int(os.getenv("SLOW_TRACE_MS", 2000))
+SLOW_TRACE_CAPACITY = 50
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    __slots__ = ("name", "attrs", "started_at", "start", "end", "children", "error")
+
+    def __init__(self, name, attrs=None):
+        self.name = name
+        self.attrs = attrs or {}
+        self.started_at = datetime.now()
+        self.start = time.perf_counter()
+        self.end = None
+        self.children = []
+        self.error = None
+
+    @property
+    def duration_ms(self):
+        end = self.end if self.end is not None else time.perf_counter()
+        return (end - self.start) * 1000
+
+
+@contextmanager
+def span(name, **attrs):
+    """Time a stage as a child of the current span; does nothing outside a trace"""
+    parent = _current_span.get()
+    if parent is None:
+        yield None
+        return
+
+    child = Span(name, attrs)
+    parent.children.append(child)
+    token = _current_span.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.error = type(e).__name__
+        raise
+    finally:
+        child.end = time.perf_counter()
+        _current_span.reset(token)
+
+
+def format_trace(root):
+    """Render a trace as an indented tree of span durations"""
+    lines = []
+
+    def walk(node, depth):
+        attrs = " ".join(f"{key}={value}" for key, value in node.attrs.items())
+        error = f" ❌ {node.error}" if node.error else ""
+        lines.append(f"{'  ' * depth}{node.name} {node.duration_ms:.0f}ms {attrs}{error}".rstrip())
+        for child in node.children:
+            walk(child, depth + 1)
+
+    walk(root, 0)
+    return "\n".join(lines)
+
+
+class Tracer:
+    """Opens a root span per update and keeps the slow ones"""
+
+    def __init__(self, slow_ms=SLOW_TRACE_MS, capacity=SLOW_TRACE_CAPACITY):
+        self.slow_ms = slow_ms
+        self.slow_traces = deque(maxlen=capacity)
+        self.traced = 0
+
+    @contextmanager
+    def trace(self, name, **attrs):
+        root = Span(name, attrs)
+        token = _current_span.set(root)
+        try:
+            yield root
+        except BaseException as e:
+            root.error = type(e).__name__
+            raise
+        finally:
+            root.end = time.perf_counter()
+            _current_span.reset(token)
+            self.traced += 1
+            if root.duration_ms >= self.slow_ms:
+                self.slow_traces.append(root)
+
+    def wrap(self, handler):
+        """Wrap a telegram handler so every update it handles is traced"""
+        @functools.wraps(handler)
+        async def traced_handler(update, context):
+            user = getattr(update, "effective_user", None)
+            with self.trace(handler.__name__, user=user.id if user else None):
+                return await handler(update, context)
+        return traced_handler
+
+
+tracer = Tracer()
@@ -0,0 +1,249 @@
+"""
+Token and cost accounting for OpenAI completions.
+
+Every completion is recorded in memory and flushed in batches to llm_usage
+(one compact row per call) and usage_daily (per day/user/model rollups that
+the /usage command reads). The in-memory counters also drive the daily and
+per-user token budgets: once a budget is exceeded, the bot serves cached
+answers where it can and otherwise asks for shorter completions.
+"""
+
+import os
+import re
+import threading
+from collections import OrderedDict
+from datetime import date, datetime
+
+DAILY_TOKEN_BUDGET = int(os.getenv("DAILY_TOKEN_BUDGET", 0))            # 0 = unlimited
+USER_DAILY_TOKEN_BUDGET = int(os.getenv("USER_DAILY_TOKEN_BUDGET", 0))  # 0 = unlimited
+DEGRADED_MAX_TOKENS = int(os.getenv("DEGRADED_MAX_TOKENS", 150))
+ANSWER_CACHE_SIZE = 500
+MAX_PENDING_ROWS = 10000  # unflushed rows kept in memory while the database is down
+
+# USD per 1K tokens: (prompt, completion)
+MODEL_PRICES = {
+    "gpt-3.5-turbo": (0.0005, 0.0015),
+    "gpt-4o-mini": (0.00015, 0.0006),
+    "gpt-4o": (0.0025, 0.01),
+}
+
+SYSTEM_USER_ID = 0  # rollup key for usage not tied to a Telegram user (e.g. lead enrichment)
+
+
+def model_prices(model):
+    """Prices for a model, matching versioned names like gpt-3.5-turbo-0125 by longest prefix"""
+    if model in MODEL_PRICES:
+        return MODEL_PRICES[model]
+    for name in sorted(MODEL_PRICES, key=len, reverse=True):
+        if model.startswith(name):
+            return MODEL_PRICES[name]
+    return (0.0, 0.0)
+
+
+def estimate_cost(model, prompt_tokens, completion_tokens):
+    prompt_price, completion_price = model_prices(model)
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1000
+
+
+def normalize_question(text):
+    return re.sub(r"\s+", " ", text.strip().lower())
+
+
+schema_ready = False
+
+
+def ensure_usage_schema(conn):
+    """Create the usage tables; flush() retries this if the database was down at startup"""
+    global schema_ready
+    with conn.cursor() as cur:
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS llm_usage (
+                id BIGSERIAL PRIMARY KEY,
+                created_at TIMESTAMP NOT NULL,
+                inquiry_key UUID,
+                user_id BIGINT,
+                source VARCHAR(20),
+                model VARCHAR(50),
+                prompt_tokens INTEGER,
+                completion_tokens INTEGER,
+                latency_ms INTEGER,
+                cached BOOLEAN DEFAULT FALSE
+            )
+        ''')
+        cur.execute("ALTER TABLE llm_usage ADD COLUMN IF NOT EXISTS inquiry_key UUID")
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS usage_daily (
+                day DATE NOT NULL,
+                user_id BIGINT NOT NULL,
+                model VARCHAR(50) NOT NULL,
+                requests INTEGER NOT NULL DEFAULT 0,
+                cached_requests INTEGER NOT NULL DEFAULT 0,
+                prompt_tokens BIGINT NOT NULL DEFAULT 0,
+                completion_tokens BIGINT NOT NULL DEFAULT 0,
+                latency_ms BIGINT NOT NULL DEFAULT 0,
+                PRIMARY KEY (day, user_id, model)
+            )
+        ''')
+    conn.commit()
+    schema_ready = True
+
+
+class UsageTracker:
+    """Collects completion usage in memory and enforces token budgets"""
+
+    def __init__(self, daily_budget=DAILY_TOKEN_BUDGET, user_budget=USER_DAILY_TOKEN_BUDGET):
+        self.daily_budget = daily_budget
+        self.user_budget = user_budget
+        self.lock = threading.Lock()
+        self.pending = []
+        self.day = date.today()
+        self.tokens_today = 0
+        self.user_tokens_today = {}
+        self.answers = OrderedDict()
+
+    # === RECORDING ===
+    def record(self, user_id, model, prompt_tokens, completion_tokens, latency_ms, source="chat",
+               cached=False, inquiry_key=None):
+        now = datetime.now()
+        with self.lock:
+            self._roll_day(now.date())
+            tokens = prompt_tokens + completion_tokens
+            self.tokens_today += tokens
+            if user_id is not None:
+                self.user_tokens_today[user_id] = self.user_tokens_today.get(user_id, 0) + tokens
+            self.pending.append(
+                (now, inquiry_key, user_id, source, model, prompt_tokens, completion_tokens, int(latency_ms), cached)
+            )
+            self._trim()
+
+    def record_completion(self, response, user_id, model, latency_ms, source="chat", inquiry_key=None):
+        """
+        Record the usage block of an openai.ChatCompletion response.
+        Stored under the requested model name, not the versioned one the API echoes
+        back, so rollups and price lookups stay consistent.
+        """
+        usage = response.get("usage") or {}
+        self.record(
+            user_id,
+            model,
+            usage.get("prompt_tokens", 0),
+            usage.get("completion_tokens", 0),
+            latency_ms,
+            source=source,
+            inquiry_key=inquiry_key
+        )
+
+    def _trim(self):
+        """Drop the oldest unflushed rows past MAX_PENDING_ROWS (call with the lock held)"""
+        excess = len(self.pending) - MAX_PENDING_ROWS
+        if excess > 0:
+            del self.pending[:excess]
+            print(f"⚠️ Usage buffer full, dropped {excess} unflushed row(s)")
+
+    def _roll_day(self, today):
+        if today != self.day:
+            self.day = today
+            self.tokens_today = 0
+            self.user_tokens_today = {}
+
+    # === BUDGETS ===
+    def over_budget(self, user_id):
+        """True if the global or this user's daily token budget has been used up"""
+        with self.lock:
+            self._roll_day(date.today())
+            if self.daily_budget and self.tokens_today >= self.daily_budget:
+                return True
+            if self.user_budget and self.user_tokens_today.get(user_id, 0) >= self.user_budget:
+                return True
+            return False
+
+    def remember_answer(self, question, answer):
+        key = normalize_question(question)
+        with self.lock:
+            self.answers[key] = answer
+            self.answers.move_to_end(key)
+            while len(self.answers) > ANSWER_CACHE_SIZE:
+                self.answers.popitem(last=False)
+
+    def cached_answer(self, question):
+        key = normalize_question(question)
+        with self.lock:
+            answer = self.answers.get(key)
+            if answer is not None:
+                self.answers.move_to_end(key)
+            return answer
+
+    def load_today(self, conn):
+        """Seed the budget counters from today's rollups plus rows not flushed yet"""
+        today = date.today()
+        with conn.cursor() as cur:
+            cur.execute('''
+                SELECT user_id, SUM(prompt_tokens + completion_tokens)
+                FROM usage_daily
+                WHERE day = %s
+                GROUP BY user_id
+            ''', (today,))
+            rows = cur.fetchall()
+        with self.lock:
+            self.day = today
+            self.user_tokens_today = {user_id: int(tokens) for user_id, tokens in rows if user_id != SYSTEM_USER_ID}
+            self.tokens_today = sum(int(tokens) for _, tokens in rows)
+            for created_at, _, user_id, _, _, prompt, completion, _, _ in self.pending:
+                if created_at.date() == today:
+                    self.tokens_today += prompt + completion
+                    if user_id is not None:
+                        self.user_tokens_today[user_id] = self.user_tokens_today.get(user_id, 0) + prompt + completion
+
+    # === FLUSHING ===
+    def flush(self, conn):
+        """Write pending usage rows and their rollups in one transaction; returns rows written"""
+        if not schema_ready:
+            # Startup couldn't reach the database: create the tables and restore today's budgets now
+            ensure_usage_schema(conn)
+            self.load_today(conn)
+
+        with self.lock:
+            rows, self.pending = self.pending, []
+        if not rows:
+            return 0
+
+        rollups = {}
+        for created_at, inquiry_key, user_id, source, model, prompt, completion, latency, cached in rows:
+            key = (created_at.date(), user_id if user_id is not None else SYSTEM_USER_ID, model)
+            totals = rollups.setdefault(key, [0, 0, 0, 0, 0])
+            totals[0] += 1
+            totals[1] += int(cached)
+            totals[2] += prompt
+            totals[3] += completion
+            totals[4] += latency
+
+        try:
+            with conn.cursor() as cur:
+                cur.executemany('''
+                    INSERT INTO llm_usage (created_at, inquiry_key, user_id, source, model, prompt_tokens,
+                                           completion_tokens, latency_ms, cached)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+                ''', rows)
+                cur.executemany('''
+                    INSERT INTO usage_daily (day, user_id, model, requests, cached_requests,
+                                             prompt_tokens, completion_tokens, latency_ms)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                    ON CONFLICT (day, user_id, model) DO UPDATE SET
+                        requests = usage_daily.requests + EXCLUDED.requests,
+                        cached_requests = usage_daily.cached_requests + EXCLUDED.cached_requests,
+                        prompt_tokens = usage_daily.prompt_tokens + EXCLUDED.prompt_tokens,
+                        completion_tokens = usage_daily.completion_tokens + EXCLUDED.completion_tokens,
+                        latency_ms = usage_daily.latency_ms + EXCLUDED.latency_ms
+                ''', [key + tuple(totals) for key, totals in rollups.items()])
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            # Keep the rows for the next flush instead of losing them
+            with self.lock:
+                self.pending[:0] = rows
+                self._trim()
+            raise
+        return len(rows)
+
+
+usage_tracker = UsageTracker()